@@ -1,8 +1,21 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import argparse, csv, sys, time, requests, re
-from urllib.parse import quote
+import argparse, asyncio, csv, json, os, sqlite3, sys, time, random, re
+
+import aiohttp
+
+try:
+    from orjson import loads as json_loads  # C parser, several times faster on UniProt records
+except ImportError:
+    from json import loads as json_loads
+
+IO_BUFFER = 1 << 20  # 1 MiB file buffers: fewer read()/write() syscalls than the 8 KiB default
+
+UNIPROT_ACCESSIONS_URL = "https://rest.uniprot.org/uniprotkb/accessions"
+MAX_PAGE = 500  # largest page the UniProt REST API serves per request
+# Sent on every request of the shared session; gzip shrinks the JSON several-fold on the wire
+HTTP_HEADERS = {"User-Agent": "EnzGraph/1.0", "Accept": "application/json", "Accept-Encoding": "gzip"}
 
 HEADER_MAP = {
     "Entry": "acc",
@@ -26,9 +39,18 @@ def parse_args():
     ap = argparse.ArgumentParser(description="Enrich UniProt TSV with reviewed + CAZy/ESTHER xrefs (JSON API)")
     ap.add_argument("inp", help="Input TSV WITH HEADER (UniProt export)")
     ap.add_argument("out", help="Output TSV (same columns + enrichment)")
-    ap.add_argument("--batch", type=int, default=200)
+    ap.add_argument("--batch", type=int, default=MAX_PAGE,
+                    help=f"Accessions per request (default/max: {MAX_PAGE})")
     ap.add_argument("--sleep", type=float, default=0.25)
     ap.add_argument("--retries", type=int, default=5)
+    ap.add_argument("--concurrency", type=int, default=8,
+                    help="Max batches in flight at once (default: 8)")
+    ap.add_argument("--cache", default="~/.cache/enzgraph/uniprot.sqlite",
+                    help="SQLite cache of enrichment per accession (default: ~/.cache/enzgraph/uniprot.sqlite)")
+    ap.add_argument("--cache-ttl-days", type=float, default=30,
+                    help="Refetch cached accessions older than this (default: 30)")
+    ap.add_argument("--no-cache", action="store_true",
+                    help="Neither read nor write the cache")
     return ap.parse_args()
 
 def normalize_header(h):
@@ -38,21 +60,41 @@ def normalize_header(h):
     return h2
 
 def read_with_header(inp):
-    import csv
-    with open(inp, newline='') as f:
-        reader = csv.DictReader(f, delimiter="\t")
-        norm_fieldnames = [normalize_header(h) for h in reader.fieldnames]
-        to_internal = {}
-        for raw in norm_fieldnames:
-            to_internal[raw] = HEADER_MAP.get(raw, raw)
+    """
+    Rows as plain lists, padded/trimmed to the header width, plus the internal
+    column names in header order (no per-row dicts are built).
+    """
+    with open(inp, newline='', buffering=IO_BUFFER) as f:
+        reader = csv.reader(f, delimiter="\t")
+        header = [normalize_header(h) for h in next(reader)]
+        colnames = [HEADER_MAP.get(h, h) for h in header]
+        n = len(colnames)
         rows = []
         for r in reader:
-            nr = {}
-            for raw_key, val in r.items():
-                nk = to_internal.get(normalize_header(raw_key), raw_key)
-                nr[nk] = val
-            rows.append(nr)
-        return rows, list(to_internal.values())
+            if not r:  # blank line
+                continue
+            if len(r) != n:
+                r = (r + [""] * n)[:n]
+            rows.append(r)
+        return rows, colnames
+
+class RecoverableError(Exception):
+    """Transient failure (429, 5xx, dropped connection/timeout): worth retrying."""
+
+class UnrecoverableError(Exception):
+    """Client error (4xx other than 429): retrying will not help, fail fast."""
+
+def retry_delay(attempt, sleep=0.25, retry_after=None, jitter=0.5, cap=30.0):
+    """
+    Seconds to wait before the next attempt. A numeric Retry-After header wins;
+    otherwise exponential backoff with jitter so concurrent batches don't retry
+    in lockstep.
+    """
+    try:
+        return max(0.0, float(retry_after))
+    except (TypeError, ValueError):
+        pass
+    return min(cap, sleep * (2 ** attempt) * (1 + jitter * random.random()))
 
 def safe_prop(props, key):
     for kv in props or []:
@@ -60,9 +102,10 @@ def safe_prop(props, key):
             return kv.get("value","")
     return ""
 
-def uniprot_fetch_json_batch(accs, retries=5, sleep=0.25):
+async def uniprot_fetch_json_batch(session, accs, retries=5, sleep=0.25):
     """
-    Query UniProtKB search JSON and extract:
+    Look up accessions via the UniProtKB accessions endpoint (over a shared
+    aiohttp session) and extract:
       - reviewed (bool via entryType)
       - xref_cazy (string; CAZy ids or family names joined by ';')
       - xref_esther (string; ESTHER ids/family names joined by ';')
@@ -70,22 +113,31 @@ def uniprot_fetch_json_batch(accs, retries=5, sleep=0.25):
     if not accs:
         return {}
 
-    # Build OR query on accession; request a generous page size
-    q = " OR ".join(f"accession:{a}" for a in accs)
-    url = f"https://rest.uniprot.org/uniprotkb/search?query={quote(q)}&format=json&size=500"
+    # One comma-separated list instead of an 'accession:A OR accession:B ...' query:
+    # shorter URL and no query parsing server-side
+    params = {"accessions": ",".join(accs), "format": "json", "size": MAX_PAGE}
+    what = f"batch of {len(accs)} starting at {accs[0]}"
 
     attempt = 0
     while True:
         attempt += 1
-        r = requests.get(url, timeout=60)
-        if r.status_code == 200:
-            break
-        if r.status_code in (429, 502, 503, 504) and attempt <= retries:
-            time.sleep(min(5.0, sleep * attempt * 2))
-            continue
-        r.raise_for_status()
+        retry_after = None
+        try:
+            async with session.get(UNIPROT_ACCESSIONS_URL, params=params,
+                                   timeout=aiohttp.ClientTimeout(total=60)) as r:
+                if r.status == 200:
+                    data = json_loads(await r.read())
+                    break
+                if 400 <= r.status < 500 and r.status != 429:
+                    raise UnrecoverableError(f"UniProt returned HTTP {r.status} for {what}")
+                retry_after = r.headers.get("Retry-After")
+                err = RecoverableError(f"UniProt returned HTTP {r.status} for {what}")
+        except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError) as e:
+            err = RecoverableError(f"{type(e).__name__}: {e}")
+        if attempt > retries:
+            raise err
+        await asyncio.sleep(retry_delay(attempt, sleep, retry_after))
 
-    data = r.json()
     results = data.get("results", [])
     out = {}
     for rec in results:
@@ -126,33 +178,102 @@ def uniprot_fetch_json_batch(accs, retries=5, sleep=0.25):
         }
     return out
 
+# ------------------------------ Cache -----------------------------------------
+
+def open_cache(path):
+    """Open (creating if needed) the accession cache; WAL lets concurrent runs share it."""
+    path = os.path.expanduser(path)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    db = sqlite3.connect(path)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("CREATE TABLE IF NOT EXISTS uprot(acc TEXT PRIMARY KEY, json TEXT, ts INTEGER)")
+    return db
+
+def cache_get(db, accs, ttl):
+    """Cached enrichment for accs fetched within the last `ttl` seconds."""
+    oldest = int(time.time() - ttl)
+    out = {}
+    for i in range(0, len(accs), 900):  # keep under SQLite's bound-parameter limit
+        chunk = accs[i:i+900]
+        q = f"SELECT acc, json FROM uprot WHERE ts >= ? AND acc IN ({','.join('?' * len(chunk))})"
+        for acc, blob in db.execute(q, [oldest, *chunk]):
+            out[acc] = json_loads(blob)
+    return out
+
+def cache_put(db, enrich):
+    now = int(time.time())
+    with db:
+        db.executemany("INSERT OR REPLACE INTO uprot(acc, json, ts) VALUES (?,?,?)",
+                       [(acc, json.dumps(e), now) for acc, e in enrich.items()])
+
+async def fetch_all(accs, batch=MAX_PAGE, retries=5, sleep=0.25, concurrency=8, cache=None):
+    """
+    Fetch all batches concurrently: at most `concurrency` requests in flight,
+    all sharing one keep-alive connection pool. Each slot still pauses `sleep`
+    seconds after its batch to stay polite with the UniProt API.
+    Each finished batch is stored in `cache` (if given) right away, so an
+    interrupted run keeps what it already fetched.
+    """
+    batches = [accs[i:i+batch] for i in range(0, len(accs), batch)]
+    sem = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=16, keepalive_timeout=60, ttl_dns_cache=300)
+    async with aiohttp.ClientSession(connector=connector, headers=HTTP_HEADERS) as session:
+        async def fetch(b):
+            async with sem:
+                res = await uniprot_fetch_json_batch(session, b, retries=retries, sleep=sleep)
+                if cache is not None:
+                    cache_put(cache, res)
+                await asyncio.sleep(sleep)
+                return res
+        results = await asyncio.gather(*[fetch(b) for b in batches])
+
+    enrich = {}
+    for res in results:
+        enrich.update(res)
+    return enrich
+
 def main():
     args = parse_args()
+    if not 0 < args.batch <= MAX_PAGE:
+        sys.exit(f"[error] --batch must be between 1 and {MAX_PAGE} (one result page per request)")
     rows, colnames = read_with_header(args.inp)
 
-    accs = [r.get("acc","") for r in rows if r.get("acc")]
+    idx = {c: i for i, c in enumerate(colnames)}
+    acc_i = idx.get("acc")
+    accs = [r[acc_i] for r in rows if r[acc_i]] if acc_i is not None else []
     seen, uniq = set(), []
     for a in accs:
         if a not in seen:
             seen.add(a); uniq.append(a)
 
-    enrich = {}
-    for i in range(0, len(uniq), args.batch):
-        batch = uniq[i:i+args.batch]
-        enrich.update(uniprot_fetch_json_batch(batch, retries=args.retries, sleep=args.sleep))
-        time.sleep(args.sleep)
-
-    out_cols = colnames + ["reviewed","xref_cazy","xref_esther"]
-    with open(args.out, "w", newline='') as g:
-        w = csv.DictWriter(g, delimiter="\t", fieldnames=out_cols)
-        w.writeheader()
+    enrich, cache = {}, None
+    if not args.no_cache:
+        cache = open_cache(args.cache)
+        enrich = cache_get(cache, uniq, args.cache_ttl_days * 86400)
+        sys.stderr.write(f"[cache] {len(enrich)}/{len(uniq)} accessions served from {args.cache}\n")
+
+    todo = [a for a in uniq if a not in enrich]
+    try:
+        enrich.update(asyncio.run(fetch_all(todo, batch=args.batch, retries=args.retries,
+                                            sleep=args.sleep, concurrency=args.concurrency,
+                                            cache=cache)))
+    finally:
+        if cache is not None:
+            cache.close()
+
+    enrich_cols = ["reviewed","xref_cazy","xref_esther"]
+    out_cols = colnames + enrich_cols
+    # re-running on an enriched TSV: refresh the existing enrichment columns too
+    refresh = [(idx[c], j) for j, c in enumerate(enrich_cols) if c in idx]
+    with open(args.out, "w", newline='', buffering=IO_BUFFER) as g:
+        w = csv.writer(g, delimiter="\t")
+        w.writerow(out_cols)
         for r in rows:
-            e = enrich.get(r.get("acc",""), {})
-            r2 = dict(r)
-            r2["reviewed"] = e.get("reviewed","")
-            r2["xref_cazy"] = e.get("xref_cazy","")
-            r2["xref_esther"] = e.get("xref_esther","")
-            w.writerow(r2)
+            e = enrich.get(r[acc_i], {}) if acc_i is not None else {}
+            extra = [e.get(c, "") for c in enrich_cols]
+            for i, j in refresh:
+                r[i] = extra[j]
+            w.writerow(r + extra)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -3,6 +3,9 @@
 
 import argparse, csv, sys, re
 from collections import Counter
+from contextlib import ExitStack
+
+IO_BUFFER = 1 << 20  # 1 MiB read/write buffers (default is 8 KiB)
 
 # ----------------------------- Header mapping ---------------------------------
 
@@ -30,6 +33,15 @@ HEADER_MAP = {
     "xref_esther": "xref_esther",
 }
 
+# ---------------------------- Compiled patterns -------------------------------
+
+# ';' and ',' become spaces so str.split() tokenizes on them and on any whitespace
+_SEMI_TRANS = str.maketrans(";,", "  ")
+_NORM_RE = re.compile(r"[^A-Z0-9]+")
+_CAZY_SPLIT_RE = re.compile(r"[;,]\s*")
+# One pass over a CATALYTIC ACTIVITY block: group 1 = EC, 2 = RHEA id, 3 = ECO:0000269
+_CATALYTIC_RE = re.compile(r"EC=([\d.]+)|(RHEA:\d+)|(ECO:0000269)")
+
 # ------------------------------- CLI ------------------------------------------
 
 def parse_args():
@@ -58,25 +70,35 @@ def normalize_header(h):
     return h2
 
 def read_with_header(inp):
-    with open(inp, newline='') as f:
-        reader = csv.DictReader(f, delimiter="\t")
-        norm_fieldnames = [normalize_header(h) for h in reader.fieldnames]
-        to_internal = {raw: HEADER_MAP.get(raw, raw) for raw in norm_fieldnames}
+    # csv.reader + one zip per row: a single dict keyed by internal names,
+    # instead of DictReader's dict plus a renamed copy
+    with open(inp, newline='', buffering=IO_BUFFER) as f:
+        reader = csv.reader(f, delimiter="\t")
+        cols = [HEADER_MAP.get(h, h) for h in map(normalize_header, next(reader))]
+        n = len(cols)
         rows = []
         for r in reader:
-            nr = {}
-            for raw_key, val in r.items():
-                nk = to_internal.get(normalize_header(raw_key), raw_key)
-                nr[nk] = val
-            rows.append(nr)
-        return rows, list(to_internal.values())
+            if not r:  # blank line
+                continue
+            if len(r) < n:
+                r += [""] * (n - len(r))
+            rows.append(dict(zip(cols, r)))
+        return rows, cols
 
 # -------------------------------- Utils ---------------------------------------
 
 def parse_semilist(x):
-    x = (x or "").strip()
-    # tolerate trailing semicolons/spaces/commas
-    return [t for t in re.split(r"[;,\s]+", x) if t]
+    # same tokens as re.split(r"[;,\s]+"), minus the regex engine;
+    # runs of separators and trailing semicolons/spaces/commas yield no empty tokens
+    return (x or "").translate(_SEMI_TRANS).split()
+
+def row_set(row, col):
+    """Set of tokens in a list-valued column, parsed once and cached on the row as '_<col>'."""
+    key = "_" + col
+    cached = row.get(key)
+    if cached is None:
+        cached = row[key] = set(parse_semilist(row.get(col, "")))
+    return cached
 
 def has_secreted_eco269(subcell):
     s = subcell or ""
@@ -96,14 +118,21 @@ def scan_catalytic(catalytic, target_ecs):
     Also set eco_any269 if 269 appears anywhere in the catalytic text.
     """
     out = {ec: {"rhea": False, "eco269": False, "eco_any269": False} for ec in target_ecs}
-    if not catalytic:
+    # every flag needs a RHEA id or ECO:0000269 somewhere; plain substring tests
+    # settle the common no-evidence case without entering the regex engine
+    if not catalytic or ("ECO:0000269" not in catalytic and "RHEA:" not in catalytic):
         return out
     blocks = catalytic.split("CATALYTIC ACTIVITY:")
     for b in blocks:
-        ecs_in_block = set(re.findall(r"EC=([\d\.]+)", b))
-        rhea_here = bool(re.search(r"RHEA:\d+", b))
-        ecos = re.findall(r"ECO:\d{7}", b)
-        eco269_here = "ECO:0000269" in ecos
+        ecs_in_block = set()
+        rhea_here = eco269_here = False
+        for m in _CATALYTIC_RE.finditer(b):
+            if m.group(1):
+                ecs_in_block.add(m.group(1))
+            elif m.group(2):
+                rhea_here = True
+            else:
+                eco269_here = True
         for ec in (ecs_in_block & target_ecs):
             out[ec]["rhea"]   = out[ec]["rhea"] or rhea_here
             out[ec]["eco269"] = out[ec]["eco269"] or eco269_here
@@ -112,26 +141,55 @@ def scan_catalytic(catalytic, target_ecs):
                 out[ec]["eco_any269"] = True
     return out
 
-def high_conf_for_ec(row, ec):
+def row_catalytic(row, target_ecs):
+    """
+    scan_catalytic for the row's catalytic text, cached on the row as '_catalytic'
+    so Pfam learning and tiering share one scan (target_ecs is fixed per run).
+    """
+    cached = row.get("_catalytic")
+    if cached is None:
+        cached = row["_catalytic"] = scan_catalytic(row.get("catalytic",""), target_ecs)
+    return cached
+
+def high_conf_for_ec(row, ec, cat=None):
     """
     High-confidence seed:
       - (ECO:0000269 and RHEA) for that EC, OR
       - reviewed AND (ECO:0000269 or RHEA) for that EC
+    Pass `cat` (a scan_catalytic result covering `ec`) to reuse an earlier scan.
     """
     reviewed_ok = is_reviewed(row)
-    cat = scan_catalytic(row.get("catalytic",""), {ec})
+    if cat is None:
+        cat = scan_catalytic(row.get("catalytic",""), {ec})
     eco269 = cat[ec]["eco269"]; rhea = cat[ec]["rhea"]
     return (eco269 and rhea) or (reviewed_ok and (eco269 or rhea))
 
 # -------------------- Learn expected PFAMs per EC -----------------------------
 
+def select_candidates(rows, target_ecs):
+    """
+    Rows whose ec_list contains at least one target EC. A substring test rejects
+    most rows before any parsing; the exact set test then rules out prefix
+    matches (3.1.1.7 inside 3.1.1.74).
+    """
+    keep = []
+    for r in rows:
+        ec_text = r.get("ec_list") or ""
+        if any(ec in ec_text for ec in target_ecs) and (row_set(r, "ec_list") & target_ecs):
+            keep.append(r)
+    return keep
+
 def derive_expected_pfams(rows, target_ecs, min_abs=2, min_frac=0.10):
     seeds = {ec: [] for ec in target_ecs}
     for r in rows:
-        ecs = set(parse_semilist(r.get("ec_list","")))
-        pfams = set(parse_semilist(r.get("pfam_list","")))
-        for ec in (ecs & target_ecs):
-            if high_conf_for_ec(r, ec):
+        hits = row_set(r, "ec_list") & target_ecs
+        if not hits:
+            continue
+        # one catalytic scan per row, shared by all target ECs it carries
+        cat = row_catalytic(r, target_ecs)
+        pfams = row_set(r, "pfam_list")
+        for ec in hits:
+            if high_conf_for_ec(r, ec, cat):
                 seeds[ec].extend(pfams)
     pfam_expected = {ec: set() for ec in target_ecs}
     for ec, lst in seeds.items():
@@ -146,7 +204,7 @@ def derive_expected_pfams(rows, target_ecs, min_abs=2, min_frac=0.10):
 
 def norm_token(s):
     """Uppercase + strip non-alphanumerics: 'CE-5'->'CE5', 'GH 13'->'GH13'."""
-    return re.sub(r"[^A-Z0-9]+", "", (s or "").upper())
+    return _NORM_RE.sub("", (s or "").upper())
 
 def esther_proxy(row):
     """
@@ -163,7 +221,7 @@ def esther_proxy(row):
 def cazy_esther_ok(row, use_esther_proxy=True):
     cx = row.get("xref_cazy","") or ""
     ex = row.get("xref_esther","") or ""
-    toks = [norm_token(t) for t in re.split(r"[;,]\s*", cx) if t.strip()]
+    toks = [norm_token(t) for t in _CAZY_SPLIT_RE.split(cx) if t.strip()]
     # CAZy families indicating carbohydrate-active enzymes (GH, PL, CE, CBM)
     has_poly_cazy = any(t.startswith(("GH","PL","CE","CBM")) for t in toks)
     has_esther = bool(ex.strip())
@@ -174,17 +232,14 @@ def cazy_esther_ok(row, use_esther_proxy=True):
 # ------------------------------ Tiering ---------------------------------------
 
 def assign_tier(row, target_ecs, pfam_expected, use_esther_proxy=True):
-    ecs   = set(parse_semilist(row.get("ec_list","")))
-    pfams = set(parse_semilist(row.get("pfam_list","")))
-    pdbs  = set(parse_semilist(row.get("pdb_list","")))
-    subcell = row.get("subcellular","") or ""
-    catalytic = row.get("catalytic","") or ""
+    ecs = row_set(row, "ec_list")
 
     # filter by ECs of interest
     if not (ecs & target_ecs):
         return "skip"
 
     # Pfam expected? (lenient: if nothing was learned for any target EC, do not block)
+    pfams = row_set(row, "pfam_list")
     pfam_ok = False
     has_any_expected_defined = False
     for tec in (ecs & target_ecs):
@@ -203,21 +258,33 @@ def assign_tier(row, target_ecs, pfam_expected, use_esther_proxy=True):
     if not has_any_expected_defined:
         pfam_ok = True
 
-    # Catalytic evidence
-    cat = scan_catalytic(catalytic, target_ecs)
-    has_rhea_target = any(cat[ec]["rhea"] for ec in target_ecs)
-    has_eco269_target = any(cat[ec]["eco269"] for ec in target_ecs)
-    eco_any269 = any(cat[ec]["eco_any269"] for ec in target_ecs)
-    has_pdb = len(pdbs) > 0
-    secreted_exp = has_secreted_eco269(subcell)
-
-    # Tiers
-    is_gold = pfam_ok and has_eco269_target and (has_rhea_target or has_pdb or is_reviewed(row))
+    # Gold and silver both require pfam_ok: no need to look at the evidence otherwise
+    if not pfam_ok:
+        return "bronze"
+
+    # Catalytic evidence (shared with derive_expected_pfams via row_catalytic)
+    cat = row_catalytic(row, target_ecs).values()
+    has_rhea_target = any(c["rhea"] for c in cat)
+    has_eco269_target = any(c["eco269"] for c in cat)
+    eco_any269 = any(c["eco_any269"] for c in cat)
+    has_pdb = bool(row_set(row, "pdb_list"))
+    reviewed = is_reviewed(row)
+
+    # Tiers, first match wins
+    if has_eco269_target and (has_rhea_target or has_pdb or reviewed):
+        return "gold"
     # Allow silver if catalytic evidence exists even if family expectations were not met (pfam_ok),
     # but keep pfam_ok requirement to avoid too many silvers if you prefer stricter behavior.
-    is_silver = pfam_ok and not is_gold and (has_rhea_target or has_pdb or eco_any269 or secreted_exp or is_reviewed(row))
+    if has_rhea_target or has_pdb or eco_any269 or reviewed or has_secreted_eco269(row.get("subcellular","")):
+        return "silver"
+    return "bronze"
 
-    return "gold" if is_gold else ("silver" if is_silver else "bronze")
+def iter_tiers(rows, target_ecs, pfam_expected, use_esther_proxy=True):
+    """Yield (tier, row) for every row that is not skipped, in input order."""
+    for r in rows:
+        t = assign_tier(r, target_ecs, pfam_expected, use_esther_proxy=use_esther_proxy)
+        if t != "skip":
+            yield t, r
 
 # -------------------------------- Main ----------------------------------------
 
@@ -225,7 +292,9 @@ def main():
     args = parse_args()
     target_ecs = set(args.target_ecs)
 
-    rows, _cols = read_with_header(args.inp)
+    rows, cols = read_with_header(args.inp)
+    # Only rows carrying a target EC matter for learning and tiering; drop the rest up front
+    rows = select_candidates(rows, target_ecs)
 
     # Learn expected Pfams from your own high-confidence seeds
     pfam_expected = derive_expected_pfams(rows, target_ecs, args.min_abs, args.min_frac)
@@ -239,31 +308,27 @@ def main():
     if not any_learned:
         sys.stderr.write("  (none learned; tiering will NOT penalize family expectations)\n")
 
-    # Print compact table
-    print("acc\torganism\tlen\tECs\tPfam\tPDB?\tSecreted(269)?\tTier")
-    full_rows = []
-    for r in rows:
-        t = assign_tier(
-            r, target_ecs, pfam_expected,
-            use_esther_proxy=(not args.no_esther_proxy)
-        )
-        if t == "skip":
-            continue
-        pfams = ",".join(parse_semilist(r.get("pfam_list","")))
-        pdb_flag = "yes" if parse_semilist(r.get("pdb_list","")) else "no"
-        sec269 = "yes" if has_secreted_eco269(r.get("subcellular","")) else "no"
-        print(f'{r.get("acc","")}\t{r.get("organism","")}\t{r.get("length","")}\t'
-              f'{r.get("ec_list","")}\t{pfams}\t{pdb_flag}\t{sec269}\t{t}')
+    # Print compact table, streaming each row to the optional full dump as it is tiered
+    # (re-running on a --write-full output keeps a single Tier column)
+    fieldnames = list(dict.fromkeys(cols + ["Tier"]))
+    with ExitStack() as stack:
+        w = None
         if args.write_full:
-            r2 = dict(r); r2["Tier"] = t; full_rows.append(r2)
-
-    # Optional full dump with Tier appended
-    if args.write_full and full_rows:
-        fieldnames = list(full_rows[0].keys())
-        with open(args.write_full, "w", newline='') as g:
-            w = csv.DictWriter(g, delimiter="\t", fieldnames=fieldnames)
+            g = stack.enter_context(open(args.write_full, "w", newline='', buffering=IO_BUFFER))
+            # extrasaction="ignore" leaves out the row_set/row_catalytic caches
+            w = csv.DictWriter(g, delimiter="\t", fieldnames=fieldnames, extrasaction="ignore")
             w.writeheader()
-            for r in full_rows:
+
+        print("acc\torganism\tlen\tECs\tPfam\tPDB?\tSecreted(269)?\tTier")
+        for t, r in iter_tiers(rows, target_ecs, pfam_expected,
+                               use_esther_proxy=(not args.no_esther_proxy)):
+            pfams = ",".join(parse_semilist(r.get("pfam_list","")))
+            pdb_flag = "yes" if parse_semilist(r.get("pdb_list","")) else "no"
+            sec269 = "yes" if has_secreted_eco269(r.get("subcellular","")) else "no"
+            print(f'{r.get("acc","")}\t{r.get("organism","")}\t{r.get("length","")}\t'
+                  f'{r.get("ec_list","")}\t{pfams}\t{pdb_flag}\t{sec269}\t{t}')
+            if w is not None:
+                r["Tier"] = t
                 w.writerow(r)
 
 if __name__ == "__main__":
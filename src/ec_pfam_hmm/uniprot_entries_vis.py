@@ -2,7 +2,10 @@
 import os
 import re
 import sys
+import gzip
 import json
+import shutil
+import asyncio
 import argparse
 import textwrap
 import subprocess
@@ -11,6 +14,9 @@ import numpy as np
 import matplotlib
 matplotlib.use("Agg")  # render plots to files (no GUI)
 import matplotlib.pyplot as plt
+from collections import Counter
+
+PFAM_RE = re.compile(r"PF\d{5}")
 
 def parse_args():
     p = argparse.ArgumentParser(
@@ -30,14 +36,69 @@ def parse_args():
                    help="Run hmmpress on the combined HMM file after download")
     return p.parse_args()
 
-def parse_pfams(x):
-    if pd.isna(x):
-        return []
-    return re.findall(r"PF\d{5}", str(x))
+def wanted_column(name):
+    """Columns the summary uses: Pfam, organism name and length."""
+    c = name.strip().lower()
+    return "pfam" in c or "organism name" in c or c == "length"
 
 def wrap_labels(labels, width=30):
     return ["\n".join(textwrap.wrap(str(x), width=width)) for x in labels]
 
+# ===== Pfam HMM download (used by the optional block in main) =====
+PFAM_HMM_URL = "https://ftp.ebi.ac.uk/pub/databases/Pfam/releases/current/individual_families/{}.hmm.gz"
+
+async def _download_pfam_hmms(pfids, hmm_outdir, concurrency):
+    import aiohttp  # only needed when HMM download is enabled
+
+    sem = asyncio.Semaphore(concurrency)
+
+    async def fetch_one(session, pfid):
+        out_hmm = os.path.join(hmm_outdir, f"{pfid}.hmm")
+        if os.path.exists(out_hmm):
+            return True
+        data = b""
+        async with sem:
+            try:
+                async with session.get(PFAM_HMM_URL.format(pfid)) as r:
+                    if r.status == 200:
+                        data = await r.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                pass
+        try:
+            hmm = gzip.decompress(data) if data else b""
+        except (OSError, EOFError):  # not gzip (e.g. an HTML error page) or truncated
+            hmm = b""
+        if not hmm:
+            print(f"[warn] Could not fetch {pfid} (empty download).")
+            return False
+        with open(out_hmm, "wb") as f:
+            f.write(hmm)
+        return True
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=120)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        return await asyncio.gather(*[fetch_one(session, pfid) for pfid in pfids])
+
+def download_pfam_hmms(pfids, hmm_outdir, concurrency=16):
+    """
+    Fetch and gunzip <pfid>.hmm for each Pfam id into hmm_outdir, at most
+    `concurrency` downloads at a time; files already present are kept.
+    Returns the ids whose .hmm is available.
+    """
+    os.makedirs(hmm_outdir, exist_ok=True)
+    ok = asyncio.run(_download_pfam_hmms(pfids, hmm_outdir, concurrency))
+    return [pfid for pfid, good in zip(pfids, ok) if good]
+
+def concat_hmms(pfids, hmm_outdir, combined_path):
+    """Stream the per-family .hmm files into one combined HMM file."""
+    with open(combined_path, "wb") as w:
+        for pfid in pfids:
+            p = os.path.join(hmm_outdir, f"{pfid}.hmm")
+            if os.path.exists(p):
+                with open(p, "rb") as f:
+                    shutil.copyfileobj(f, w)
+
 def main():
     args = parse_args()
 
@@ -51,18 +112,20 @@ def main():
     if not os.path.exists(tsv):
         sys.exit(f"[error] TSV not found: {tsv}\nRun the UniProt fetch step first.")
 
-    # Load TSV
-    t = pd.read_csv(tsv, sep="\t")
+    # Load TSV: only the columns used below, C parser, no type inference on Length
+    t = pd.read_csv(tsv, sep="\t", usecols=wanted_column, dtype={"Length": "Int32"}, engine="c")
     t = t.rename(columns=lambda c: c.strip())
 
     # Detect Pfam column
     pfam_col_candidates = [c for c in t.columns if "pfam" in c.lower()]
     pfam_col = pfam_col_candidates[0] if pfam_col_candidates else None
+    pf = Counter()
     if pfam_col is None:
         print("[warn] No Pfam column found in TSV; PFAM plots will be skipped.")
-        t["Pfam_list"] = [[]]*len(t)
     else:
-        t["Pfam_list"] = t[pfam_col].apply(parse_pfams)
+        # count ids straight off the regex matches; no per-domain rows are materialized
+        for x in t[pfam_col].dropna().astype(str):
+            pf.update(PFAM_RE.findall(x))
 
     print(f"[info] EC={ec}")
     print(f"[info] Sequences: {len(t)}")
@@ -70,10 +133,10 @@ def main():
     os.makedirs(indir, exist_ok=True)
 
     # ===== Visual 1: PFAM distribution =====
-    pf = t["Pfam_list"].explode().dropna()
     pfam_counts = None
-    if not pf.empty:
-        pfam_counts = pf.value_counts()
+    if pf:
+        # most_common keeps first-seen order among ties, like value_counts
+        pfam_counts = pd.Series(dict(pf.most_common()))
         top = pfam_counts.head(args.top_n_pfams)
         plt.figure(figsize=(8,4))
         top.plot(kind="bar")
@@ -124,33 +187,14 @@ def main():
     # # ===== Optional: download Pfam HMMs =====
     # combined_path = None
     # if args.download_hmms and pfam_counts is not None:
-    #     uniq_pfams = sorted(set(pf.dropna().tolist()))
+    #     uniq_pfams = sorted(pf)
     #     if uniq_pfams:
-    #         os.makedirs(hmm_outdir, exist_ok=True)
     #         print(f"[info] Downloading {len(uniq_pfams)} Pfam HMMs → {hmm_outdir}")
-    #         for pfid in uniq_pfams:
-    #             url = f"https://ftp.ebi.ac.uk/pub/databases/Pfam/releases/current/individual_families/{pfid}.hmm.gz"
-    #             out_gz = os.path.join(hmm_outdir, f"{pfid}.hmm.gz")
-    #             out_hmm = os.path.join(hmm_outdir, f"{pfid}.hmm")
-    #             if os.path.exists(out_hmm):
-    #                 continue
-    #             # download
-    #             subprocess.run(["curl", "-sL", url, "-o", out_gz], check=False)
-    #             if os.path.exists(out_gz) and os.path.getsize(out_gz) > 0:
-    #                 subprocess.run(["gunzip", "-f", out_gz], check=False)
-    #             else:
-    #                 print(f"[warn] Could not fetch {pfid} (empty download).")
-    #                 try: os.remove(out_gz)
-    #                 except: pass
+    #         fetched = download_pfam_hmms(uniq_pfams, hmm_outdir)
 
     #         # Concatenate into one HMM file
     #         combined_path = os.path.join(hmm_outdir, f"EC{ec}.Pfam-A.subset.hmm")
-    #         with open(combined_path, "w") as w:
-    #             for pfid in uniq_pfams:
-    #                 p = os.path.join(hmm_outdir, f"{pfid}.hmm")
-    #                 if os.path.exists(p):
-    #                     with open(p) as f:
-    #                         w.write(f.read().rstrip() + "\n")
+    #         concat_hmms(fetched, hmm_outdir, combined_path)
     #         print(f"[save] Combined HMMs: {combined_path}")
 
     #         if args.hmmpress and os.path.exists(combined_path):
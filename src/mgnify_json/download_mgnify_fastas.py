@@ -1,48 +1,170 @@
+import argparse
+import asyncio
+import random
+import sqlite3
+import aiofiles
+import aiohttp
 import pandas as pd
-import requests
 from pathlib import Path
 
+try:
+    from orjson import loads as json_loads  # C parser straight from the response bytes
+except ImportError:
+    from json import loads as json_loads
+
 # === CONFIGURATION ===
-csv_path = Path("/Users/christofdeboom/Library/CloudStorage/OneDrive-KULeuven/IBP/Mora_updatedPipeline/similarity_json/csv_subset_boi/subset_PF10503.csv")  # <-- Update this path
-output_dir = Path("downloaded_fastas")
-ok_dir = output_dir / "ok"
-nf_dir = output_dir / "not_found"
-ok_list_file = output_dir / "downloaded.txt"
-nf_list_file = output_dir / "not_found.txt"
-
-# === SETUP OUTPUT DIRECTORIES ===
-ok_dir.mkdir(parents=True, exist_ok=True)
-nf_dir.mkdir(parents=True, exist_ok=True)
-ok_list_file.write_text("")
-nf_list_file.write_text("")
-
-# === READ MGYP IDs FROM CSV ===
-df = pd.read_csv(csv_path)
-mgyp_ids = df.iloc[:, 0].dropna().unique()  # Assumes MGYP IDs are in the first column
+ESMATLAS_URL = "https://api.esmatlas.com/fetchSequence/{}"
+DEFAULT_CONCURRENCY = 20  # requests in flight at once; stays well under ESMAtlas' per-host rate limit
+FLUSH_EVERY = 1000  # IDs buffered before appending to downloaded.txt / not_found.txt
+MAX_RETRIES = 5     # attempts per ID on 429 / 5xx / dropped connections before it counts as not found
 
 # === FUNCTION TO DOWNLOAD FASTA ===
-def download_fasta(mgyp_id):
-    url = f"https://api.esmatlas.com/fetchSequence/{mgyp_id}"
-    headers = {'Accept': 'application/json'}
+def fasta_record(mgyp_id, sequence, width=60):
+    """One FASTA record, sequence wrapped at `width`, built as a single string."""
+    lines = [sequence[i:i+width] for i in range(0, len(sequence), width)]
+    return f">{mgyp_id}\n" + "\n".join(lines) + "\n"
+
+async def fetch_sequence(sem, session, mgyp_id):
+    """
+    Sequence for one ID from ESMAtlas, or "" if it cannot be had.
+    Rate limiting (429) and server errors are retried with exponential
+    backoff, honoring Retry-After; other statuses are final.
+    """
+    url = ESMATLAS_URL.format(mgyp_id)
+    for attempt in range(MAX_RETRIES):
+        delay = min(60, 2 ** attempt + random.random())
+        try:
+            async with sem:
+                async with session.get(url) as response:
+                    if response.status == 200:
+                        return json_loads(await response.read()).get("sequence", "")
+                    if response.status == 429:
+                        try:
+                            delay = float(response.headers.get("Retry-After", 2 ** attempt))
+                        except ValueError:  # HTTP-date form
+                            pass
+                    elif response.status not in (500, 502, 503, 504):
+                        return ""
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            pass
+        except Exception:
+            return ""
+        # back off outside the semaphore so other IDs keep using the slot
+        if attempt + 1 < MAX_RETRIES:
+            await asyncio.sleep(delay)
+    return ""
+
+async def download_fasta(sem, session, cache, ok_dir, mgyp_id):
+    """
+    Write <mgyp_id>.fasta, taking the sequence from the local cache when it
+    was fetched before and from ESMAtlas otherwise; returns (mgyp_id, ok).
+    """
+    row = cache.execute("SELECT s FROM seq WHERE id = ?", (mgyp_id,)).fetchone()
+    if row:
+        sequence = row[0]
+    else:
+        sequence = await fetch_sequence(sem, session, mgyp_id)
+        if not sequence:
+            return mgyp_id, False
+        cache.execute("INSERT OR REPLACE INTO seq VALUES (?, ?)", (mgyp_id, sequence))
+
     try:
-        response = requests.get(url, headers=headers, timeout=30)
-        if response.status_code == 200:
-            data = response.json()
-            sequence = data.get("sequence", "")
-            if sequence:
-                fasta_content = f">{mgyp_id}\n" + "\n".join(sequence[i:i+60] for i in range(0, len(sequence), 60))
-                with open(ok_dir / f"{mgyp_id}.fasta", "w") as f:
-                    f.write(fasta_content)
-                with open(ok_list_file, "a") as f:
-                    f.write(f"{mgyp_id}\n")
-                return True
+        async with aiofiles.open(ok_dir / f"{mgyp_id}.fasta", "w") as f:
+            await f.write(fasta_record(mgyp_id, sequence))
     except Exception:
-        pass
-    with open(nf_list_file, "a") as f:
-        f.write(f"{mgyp_id}\n")
-    return False
-
-# === DOWNLOAD LOOP ===
-for i, mgyp_id in enumerate(mgyp_ids, 1):
-    print(f"[{i}/{len(mgyp_ids)}] Downloading {mgyp_id}...")
-    download_fasta(mgyp_id)
\ No newline at end of file
+        return mgyp_id, False
+    return mgyp_id, True
+
+def open_cache(path):
+    """ID -> sequence store shared across runs (WAL, like the UniProt cache)."""
+    db = sqlite3.connect(path)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("CREATE TABLE IF NOT EXISTS seq(id TEXT PRIMARY KEY, s TEXT)")
+    return db
+
+async def download_all(mgyp_ids, output_dir, concurrency=DEFAULT_CONCURRENCY):
+    """
+    Download every ID, recording results in the list files as they complete:
+    each file is opened once and appended to in batches of FLUSH_EVERY,
+    so an interrupted run still keeps (almost all of) what it finished.
+    New sequences are committed to the cache on the same schedule.
+    """
+    sem = asyncio.Semaphore(concurrency)
+    # One pooled keep-alive connector for the whole run: TLS handshakes and DNS
+    # lookups happen once per connection, not once per ID
+    connector = aiohttp.TCPConnector(limit_per_host=concurrency, keepalive_timeout=60, ttl_dns_cache=300)
+    ok_ids, nf_ids = [], []
+    n_ok = n_nf = 0
+    cache = open_cache(output_dir / "sequences.db")  # sequences already fetched, reused across runs
+    timeout = aiohttp.ClientTimeout(total=30)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                     headers={'Accept': 'application/json'}) as session:
+        tasks = [download_fasta(sem, session, cache, output_dir / "ok", m) for m in mgyp_ids]
+        with open(output_dir / "downloaded.txt", "a") as ok_f, open(output_dir / "not_found.txt", "a") as nf_f:
+            def flush():
+                cache.commit()
+                ok_f.writelines(f"{m}\n" for m in ok_ids)
+                nf_f.writelines(f"{m}\n" for m in nf_ids)
+                ok_f.flush(); nf_f.flush()
+                ok_ids.clear(); nf_ids.clear()
+
+            for i, fut in enumerate(asyncio.as_completed(tasks), 1):
+                mgyp_id, ok = await fut
+                (ok_ids if ok else nf_ids).append(mgyp_id)
+                n_ok += ok; n_nf += not ok
+                if i % FLUSH_EVERY == 0:
+                    flush()
+            flush()
+    cache.close()
+    return n_ok, n_nf
+
+def main(csv_path, output_dir, concurrency=DEFAULT_CONCURRENCY, fresh=False):
+    output_dir = Path(output_dir)
+    ok_dir = output_dir / "ok"
+    nf_dir = output_dir / "not_found"
+    ok_list_file = output_dir / "downloaded.txt"
+    nf_list_file = output_dir / "not_found.txt"
+
+    # === SETUP OUTPUT DIRECTORIES ===
+    ok_dir.mkdir(parents=True, exist_ok=True)
+    nf_dir.mkdir(parents=True, exist_ok=True)
+    if fresh or not ok_list_file.exists():
+        ok_list_file.write_text("")
+    if fresh or not nf_list_file.exists():
+        nf_list_file.write_text("")
+
+    # === READ MGYP IDs FROM CSV ===
+    # Assumes MGYP IDs are in the first column; only that column is parsed.
+    # IDs are stripped before dedup so " MGYP..." and "MGYP..." cost one request.
+    df = pd.read_csv(csv_path, usecols=[0], dtype="string")
+    ids = df.iloc[:, 0].dropna().str.strip()
+    mgyp_ids = ids[ids.str.startswith("MGYP")].unique().tolist()
+    if len(mgyp_ids) < len(df):
+        print(f"{len(df)} rows -> {len(mgyp_ids)} unique MGYP IDs "
+              f"({len(df) - len(mgyp_ids)} duplicate, blank or non-MGYP rows skipped).")
+
+    # Resume: skip IDs with a FASTA on disk or already recorded as not found
+    if not fresh:
+        done = {p.stem for p in ok_dir.glob("*.fasta")} | set(nf_list_file.read_text().split())
+        n_all = len(mgyp_ids)
+        mgyp_ids = [m for m in mgyp_ids if m not in done]
+        if n_all > len(mgyp_ids):
+            print(f"Resuming: {n_all - len(mgyp_ids)} of {n_all} IDs already done (use --fresh to redo).")
+
+    # === DOWNLOAD LOOP ===
+    print(f"Downloading {len(mgyp_ids)} sequences ({concurrency} at a time)...")
+    n_ok, n_nf = asyncio.run(download_all(mgyp_ids, output_dir, concurrency))
+    print(f"Done: {n_ok} downloaded, {n_nf} not found.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Download ESMAtlas sequences for the MGYP IDs in a CSV.")
+    parser.add_argument("--csv", required=True, help="CSV whose first column holds MGYP IDs (e.g. a subset_hits.py output).")
+    parser.add_argument("--out", default="downloaded_fastas",
+                        help="Output directory for ok/, downloaded.txt, not_found.txt and the sequence cache (default: downloaded_fastas).")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help=f"Requests in flight at once (default: {DEFAULT_CONCURRENCY}).")
+    parser.add_argument("--fresh", action="store_true",
+                        help="Start over: clear the list files and re-request every ID (default: resume)")
+
+    args = parser.parse_args()
+    main(args.csv, args.out, args.concurrency, fresh=args.fresh)
@@ -1,115 +1,133 @@
 import pandas as pd
 import argparse
-from collections import Counter
-import csv
-
-def detect_delimiter(file_path):
-    """Detect delimiter using csv.Sniffer."""
-    with open(file_path, 'r', encoding='utf-8') as f:
-        sample = f.read(2048)
-        sniffer = csv.Sniffer()
-        try:
-            dialect = sniffer.sniff(sample)
-            return dialect.delimiter
-        except csv.Error:
-            return ','  # Default to comma
-
-def load_csv_with_fallback(path):
-    """Load CSV with multiple fallback strategies."""
+
+# Biomes of interest
+BIOMES_OF_INTEREST = [
+    "root: Environmental:Aquatic:Freshwater",
+    "root: Environmental: Terrestrial: Soil",
+    "root: Environmental:Aquatic:Marine",
+    "root: Engineered: Solid waste: Composting",
+    "root: Engineered: Lab enrichment:Defined media:Anaerobic media",
+    "root: Engineered: Wastewater:Nutrient removal:Dissolved organics (anaerobic)"
+]
+# Normalized once; str.startswith takes the whole tuple in a single C call
+INTEREST_PREFIXES = tuple(b.replace(" ", "") for b in BIOMES_OF_INTEREST)
+
+# Fixed types for the hits columns the filter reads (no inference pass over them)
+HITS_DTYPE = {"hit_score": "float64", "assemblies": "string"}
+
+def read_csv_c_first(path, **kwargs):
+    """pd.read_csv with the fast C parser; the python engine only if C cannot tokenize the file."""
+    try:
+        return pd.read_csv(path, **kwargs)
+    except pd.errors.ParserError:
+        return pd.read_csv(path, engine='python', **kwargs)
+
+def load_csv_with_fallback(path, usecols=None, dtype=None):
+    """
+    Load CSV with multiple fallback strategies. With `usecols`, only those
+    columns (matched after stripping header whitespace) are parsed; if any is
+    missing the whole file is read so the caller can report what was found.
+    `dtype` skips type inference for the columns it names.
+    """
     try:
-        df = pd.read_csv(path, engine='python')
+        if usecols:
+            wanted = set(usecols)
+            df = read_csv_c_first(path, usecols=lambda c: c.strip() in wanted, dtype=dtype)
+            if len(df.columns) < len(wanted):
+                df = read_csv_c_first(path, dtype=dtype)
+        else:
+            df = read_csv_c_first(path, dtype=dtype)
         if len(df.columns) == 1:  # Fallback if header wasn't split
-            df = pd.read_csv(path, sep=",", engine='python')
+            df = read_csv_c_first(path, sep=",")
         if len(df.columns) == 1:  # Still broken? Force header=None
-            df = pd.read_csv(path, sep=",", header=None, engine='python')
+            df = read_csv_c_first(path, sep=",", header=None)
             print(f"⚠ Warning: Header missing or malformed in {path}. Columns auto-generated.")
     except Exception as e:
         raise ValueError(f"Failed to read {path}: {e}")
     return df
 
-def main(input_csv, context_csv, output_csv, top_percentage):
-    # Load files with fallback logic
-    df = load_csv_with_fallback(input_csv)
-    context_df = load_csv_with_fallback(context_csv)
-
-    # Clean headers if present
-    df.columns = df.columns.str.strip()
+def add_biomes(df, assembly_to_biome):
+    """Attach the list of biomes of each hit's assemblies; hits without any are dropped."""
+    # Vectorized: one row per assembly accession ("ERZ|url;ERZ|url"), mapped to
+    # its biome, then regrouped into a list per hit (order kept)
+    acc = df["assemblies"].astype("string").str.split(";").explode()
+    acc = acc.str.split("|", n=1).str[0].str.strip()
+    acc = acc[acc.ne("")]
+    biomes = acc.map(assembly_to_biome).dropna()
+    df["biomes"] = biomes.groupby(level=0).agg(list).reindex(df.index)
+    return df[df["biomes"].str.len().gt(0)]
+
+def main(input_csv, context_csv, output_csv, top_percentage, chunksize=None, fmt="csv"):
+    # Only the mapping columns of the context file are needed
+    context_df = load_csv_with_fallback(context_csv, usecols=["Assembly", "Biome_ID"])
     context_df.columns = context_df.columns.str.strip()
-
-    # Validate columns
-    if "hit_score" not in df.columns or "assemblies" not in df.columns:
-        raise ValueError(f"Input CSV missing required columns. Found: {df.columns.tolist()}")
     if "Assembly" not in context_df.columns or "Biome_ID" not in context_df.columns:
         raise ValueError(f"Context CSV missing required columns. Found: {context_df.columns.tolist()}")
 
-    total_rows_original = len(df)
-
-    # Map assemblies to biomes
-    assembly_to_biome = dict(zip(context_df["Assembly"], context_df["Biome_ID"]))
-
-    def map_biomes(assemblies_str):
-        assemblies = [a.split("|")[0].strip() for a in str(assemblies_str).split(";") if a.strip()]
-        biomes = [assembly_to_biome[a] for a in assemblies if a in assembly_to_biome]
-        return biomes
-
-    df["biomes"] = df["assemblies"].apply(map_biomes)
-
-    # Filter empty biomes
-    df = df[df["biomes"].apply(lambda x: len(x) > 0)]
+    # Map assemblies to biomes: an indexed Series that Series.map probes directly.
+    # Its index must be unique; a repeated Assembly keeps its last row, as dict(zip()) did.
+    assembly_to_biome = (context_df.drop_duplicates("Assembly", keep="last")
+                         .set_index("Assembly")["Biome_ID"])
+
+    # The hits file is written back in full, so all of its columns are kept.
+    # With chunksize, hits are read and biome-filtered a chunk at a time and
+    # only the survivors are held in memory.
+    if chunksize:
+        chunks = pd.read_csv(input_csv, chunksize=chunksize, dtype=HITS_DTYPE)
+    else:
+        chunks = [load_csv_with_fallback(input_csv, dtype=HITS_DTYPE)]
+
+    total_rows_original = 0
+    kept = []
+    for df in chunks:
+        # Clean headers if present
+        df.columns = df.columns.str.strip()
+        if "hit_score" not in df.columns or "assemblies" not in df.columns:
+            raise ValueError(f"Input CSV missing required columns. Found: {df.columns.tolist()}")
+        total_rows_original += len(df)
+        # Filter empty biomes
+        kept.append(add_biomes(df, assembly_to_biome))
+    df = pd.concat(kept) if len(kept) > 1 else kept[0]
     rows_after_filtering = len(df)
 
-    # Sort by hit_score
-    df_sorted = df.sort_values(by="hit_score", ascending=False)
-
-    # Top percentage
-    top_n = int(len(df_sorted) * (top_percentage / 100))
-    top_hits = df_sorted.head(top_n)
-
-    # Biomes of interest
-    biomes_of_interest = [
-        "root: Environmental:Aquatic:Freshwater",
-        "root: Environmental: Terrestrial: Soil",
-        "root: Environmental:Aquatic:Marine",
-        "root: Engineered: Solid waste: Composting",
-        "root: Engineered: Lab enrichment:Defined media:Anaerobic media",
-        "root: Engineered: Wastewater:Nutrient removal:Dissolved organics (anaerobic)"
-    ]
-    normalized_interest = [b.replace(" ", "") for b in biomes_of_interest]
-
-    biome_hits = df_sorted[df_sorted["biomes"].apply(
-        lambda b_list: isinstance(b_list, list) and any(
-            isinstance(b, str) and b.replace(" ", "").startswith(b_interest)
-            for b_interest in normalized_interest for b in b_list
-        )
-    )]
+    # Top percentage: partial selection of the best scores, no full sort needed
+    top_n = int(len(df) * (top_percentage / 100))
+    top_hits = df.nlargest(top_n, "hit_score")
+
+    # Few distinct biomes repeat across many hits: as a categorical the string
+    # ops below run once per distinct biome and the codes are just int8/int16
+    exploded = df["biomes"].explode().astype("category")
+    matched = exploded.str.replace(" ", "", regex=False).str.startswith(INTEREST_PREFIXES, na=False)
+    in_interest = matched.groupby(level=0).any()
+    biome_hits = df[in_interest.reindex(df.index, fill_value=False)]
 
     # Combine subsets
     subset = pd.concat([top_hits, biome_hits])
 
-    # Convert biomes list to string BEFORE deduplication
-    subset["biomes"] = subset["biomes"].apply(lambda x: "; ".join(x) if isinstance(x, list) else "")
-    subset = subset.drop_duplicates()
+    # Hits in both subsets share their original row index: dedup on that key
+    # alone instead of hashing every cell
+    subset = subset[~subset.index.duplicated(keep="first")]
 
-    # Save output
-    subset.to_csv(output_csv, index=False)
+    # Save output (biome lists joined only in the copy that is written)
+    out = subset.assign(biomes=subset["biomes"].str.join("; "))
+    if fmt == "parquet":
+        out.to_parquet(output_csv, compression="zstd", index=False)  # needs pyarrow
+    else:
+        out.to_csv(output_csv, index=False)
 
-    # Summary report
-    unique_biomes = set()
-    biome_counts = Counter()
-    for b_str in subset["biomes"]:
-        for b in b_str.split("; "):
-            if b.strip():
-                unique_biomes.add(b.strip())
-                biome_counts[b.strip()] += 1
+    # Summary report, counted straight from the biome lists
+    biome_counts = subset["biomes"].explode().str.strip()
+    biome_counts = biome_counts[biome_counts.ne("")].value_counts()
 
     print("\n=== SUMMARY REPORT ===")
     print(f"Total rows in original file: {total_rows_original}")
     print(f"Rows after filtering empty biomes: {rows_after_filtering}")
     print(f"Top {top_percentage}% rows: {len(top_hits)}")
     print(f"Biome matches: {len(biome_hits)}")
-    print(f"Unique biomes: {len(unique_biomes)}")
+    print(f"Unique biomes: {len(biome_counts)}")
     print("\nTop 10 biomes:")
-    for biome, count in biome_counts.most_common(10):
+    for biome, count in biome_counts.head(10).items():
         print(f"{biome}: {count}")
     print(f"\nSubset saved to {output_csv}")
 
@@ -118,7 +136,12 @@ if __name__ == "__main__":
     parser.add_argument("--input", required=True, help="Path to the main hits CSV file (filtered.csv).")
     parser.add_argument("--context", required=True, help="Path to the assembly-biome mapping CSV file (filtered.context.csv).")
     parser.add_argument("--output", required=True, help="Path to save the subset CSV file.")
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv",
+                        help="Output format (default: csv). Parquet (zstd, needs pyarrow) is much smaller "
+                             "and several times faster to write and read back.")
     parser.add_argument("--top", type=float, default=10, help="Top percentage of hits to include (default: 10).")
+    parser.add_argument("--chunksize", type=int, default=None,
+                        help="Read the hits CSV this many rows at a time to bound memory (default: all at once).")
 
     args = parser.parse_args()
-    main(args.input, args.context, args.output, args.top)
+    main(args.input, args.context, args.output, args.top, chunksize=args.chunksize, fmt=args.format)